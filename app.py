@@ -1,12 +1,15 @@
 from flask import Flask, request, jsonify, render_template, session
 import os
+import tempfile
 import uuid # Make sure uuid is imported
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from openai import OpenAI
 
 # Import the UPDATED functions from your RAG script
-from backend.scripts.rag_handler import create_system_prompt, index_uploaded_file
+from backend.scripts.rag_handler import (
+    create_system_prompt, index_uploaded_file, file_content_hash, sweep_unused_uploads, upload_lock
+)
 
 load_dotenv()
 
@@ -75,12 +78,46 @@ def upload_file():
         return jsonify({"error": "No selected file"}), 400
 
     if file and file.filename.endswith('.txt'):
-        filename = secure_filename(f"{session_id}_{file.filename}")
+        content = file.read()
+        try:
+            text = content.decode('utf-8')
+        except UnicodeDecodeError:
+            return jsonify({"error": "Could not read file, please upload a UTF-8 encoded .txt file"}), 400
+
+        if not text.strip():
+            return jsonify({"error": "The uploaded file is empty"}), 400
+
+        file_hash = file_content_hash(content)
+        filename = secure_filename(f"{file_hash}.txt")
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
 
-        # Pass the session_id to the indexing function
-        index_uploaded_file(file_path, session_id)
+        with upload_lock:
+            # Uploads are stored by content hash, so identical files are only saved once.
+            # Write to a temp file first so a partial write never appears under the final name.
+            if not os.path.exists(file_path):
+                tmp_path = None
+                try:
+                    with tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], suffix='.tmp', delete=False) as tmp:
+                        tmp_path = tmp.name
+                        tmp.write(content)
+                    os.replace(tmp_path, file_path)
+                except OSError as e:
+                    print(f"Could not save upload {filename}: {e}")
+                    if tmp_path and os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    return jsonify({"error": "Could not save the uploaded file"}), 500
+
+            # Index the in-memory text, so it always matches the hash
+            try:
+                index_uploaded_file(text, session_id, file_hash)
+            except Exception as e:
+                print(f"Error indexing file {filename} for session {session_id}: {e}")
+                return jsonify({"error": f"Could not process '{file.filename}', the previous file is still active"}), 500
+            finally:
+                try:
+                    sweep_unused_uploads(app.config['UPLOAD_FOLDER'])
+                except Exception as e:
+                    print(f"Error cleaning up unused uploads: {e}")
 
         return jsonify({"success": f"File '{file.filename}' uploaded and processed."}), 200
     else:
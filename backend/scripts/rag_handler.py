@@ -2,7 +2,10 @@
 
 import json
 import os
+import hashlib
 import glob
+import re
+import threading
 import chromadb
 from sentence_transformers import SentenceTransformer
 
@@ -16,6 +19,19 @@ print("Initializing RAG Handler...")
 model = SentenceTransformer('all-MiniLM-L6-v2')
 client = chromadb.PersistentClient(path=db_path)
 main_collection = client.get_or_create_collection("singapore_housing_main")
+# Shared store of uploaded-file chunks and their embeddings, keyed by content hash,
+# so the same file uploaded in different sessions is only embedded once.
+upload_cache_collection = client.get_or_create_collection("uploaded_file_chunks")
+
+# Cached chunks are only reused when they were built with the same chunking and
+# embedding settings. Bump INDEX_VERSION when the collection's embedding model changes.
+UPLOAD_CHUNK_SIZE = 300
+UPLOAD_CHUNK_OVERLAP = 50
+INDEX_VERSION = f"minilm-l6-v2-{UPLOAD_CHUNK_SIZE}-{UPLOAD_CHUNK_OVERLAP}"
+
+# Serializes uploads so a sweep never removes a file that another request is about to point to
+upload_lock = threading.RLock()
+UPLOAD_FILENAME_PATTERN = re.compile(r"^([0-9a-f]{64})\.txt$")
 
 def load_main_knowledge_base():
     """
@@ -75,35 +91,92 @@ def simple_chunker(text, chunk_size=300, chunk_overlap=50):
         chunks.append(" ".join(words[i:i + chunk_size]))
     return chunks
 
-def index_uploaded_file(file_path, session_id):
-    """Reads, chunks, and indexes a user-uploaded text file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        
-        # Simple chunking strategy
-        chunks = simple_chunker(text)
-        
-        # Create a new, session-specific collection
+def file_content_hash(content):
+    """Returns the SHA-256 hex digest used to content-address an uploaded file."""
+    return hashlib.sha256(content).hexdigest()
+
+def upload_cache_filter(file_hash):
+    """Returns the Chroma filter matching a file's chunks for the current INDEX_VERSION."""
+    return {"$and": [{"file_hash": file_hash}, {"index_version": INDEX_VERSION}]}
+
+def cache_file_chunks(file_hash, text):
+    """
+    Chunks and embeds a file into the shared upload cache, unless chunks for this
+    content hash and INDEX_VERSION are already stored there.
+    """
+    cached = upload_cache_collection.get(where=upload_cache_filter(file_hash), limit=1, include=[])
+    if cached['ids']:
+        print(f"Reusing cached chunks for file {file_hash[:12]}.")
+        return
+
+    chunks = simple_chunker(text, UPLOAD_CHUNK_SIZE, UPLOAD_CHUNK_OVERLAP)
+    if not chunks:
+        raise ValueError(f"File {file_hash[:12]} contains no text to index.")
+
+    upload_cache_collection.upsert(
+        documents=chunks,
+        ids=[f"{INDEX_VERSION}-{file_hash}-{i}" for i in range(len(chunks))],
+        metadatas=[{"file_hash": file_hash, "index_version": INDEX_VERSION} for _ in chunks]
+    )
+    print(f"Embedded {len(chunks)} new chunks for file {file_hash[:12]}.")
+
+def index_uploaded_file(text, session_id, file_hash):
+    """
+    Makes an uploaded file the active document for a session.
+    The chunks live in the shared upload cache; the session collection only stores
+    a pointer to the active file's hash, so replacing a file is a single write.
+    Raises if the file could not be indexed, in which case the pointer is unchanged.
+    """
+    with upload_lock:
         collection_name = f"session_{session_id}"
         session_collection = client.get_or_create_collection(name=collection_name)
-        
-        # Clear old data if user re-uploads
-        if session_collection.count() > 0:
-            # client.delete_collection(name=collection_name)
-            # session_collection = client.get_or_create_collection(name=collection_name)
-            print(f"Collection '{collection_name}' already exists. Re-indexing.")
 
+        cache_file_chunks(file_hash, text)
 
-        if chunks:
-            session_collection.add(
-                documents=chunks,
-                ids=[f"chunk_{i}" for i in range(len(chunks))]
-            )
-            print(f"Indexed {len(chunks)} chunks into collection '{collection_name}'.")
+        metadata = session_collection.metadata or {}
+        if metadata.get("active_file_hash") == file_hash:
+            print(f"File {file_hash[:12]} is already active in '{collection_name}'. Skipping.")
+            return
 
-    except Exception as e:
-        print(f"Error indexing file {file_path}: {e}")
+        session_collection.modify(metadata={"active_file_hash": file_hash})
+        print(f"Session collection '{collection_name}' now points to file {file_hash[:12]}.")
+
+        # Drop chunks stored directly in the session collection by older versions;
+        # retrieval no longer reads them once the pointer is set.
+        legacy_ids = session_collection.get(include=[])['ids']
+        if legacy_ids:
+            session_collection.delete(ids=legacy_ids)
+            print(f"Removed {len(legacy_ids)} legacy chunks from '{collection_name}'.")
+
+def sweep_unused_uploads(upload_folder):
+    """
+    Deletes cached chunks and saved upload files that no session points to any more,
+    plus chunks built with an outdated INDEX_VERSION.
+    """
+    with upload_lock:
+        active_hashes = set()
+        for collection in client.list_collections():
+            if collection.name.startswith("session_"):
+                active_file_hash = (collection.metadata or {}).get("active_file_hash")
+                if active_file_hash:
+                    active_hashes.add(active_file_hash)
+
+        cached = upload_cache_collection.get(include=['metadatas'])
+        unused_ids = [
+            chunk_id for chunk_id, meta in zip(cached['ids'], cached['metadatas'])
+            if not meta
+            or meta.get("file_hash") not in active_hashes
+            or meta.get("index_version") != INDEX_VERSION
+        ]
+        if unused_ids:
+            upload_cache_collection.delete(ids=unused_ids)
+            print(f"Removed {len(unused_ids)} unused chunks from the upload cache.")
+
+        for filename in os.listdir(upload_folder):
+            match = UPLOAD_FILENAME_PATTERN.match(filename)
+            if match and match.group(1) not in active_hashes:
+                os.remove(os.path.join(upload_folder, filename))
+                print(f"Removed unused upload {filename}.")
 
 # --- COMBINED RAG LOGIC ---
 def retrieve_context(user_msg, session_id):
@@ -130,11 +203,16 @@ def retrieve_context(user_msg, session_id):
     try:
         if any(c.name == collection_name for c in client.list_collections()):
             session_collection = client.get_collection(name=collection_name)
-            session_results = session_collection.query(
-                query_texts=[user_msg],
-                n_results=QUERY_N_RESULTS,
-                include=['documents', 'distances']
-            )
+            # Search only the session's active file in the shared upload cache
+            active_file_hash = (session_collection.metadata or {}).get("active_file_hash")
+            session_results = None
+            if active_file_hash:
+                session_results = upload_cache_collection.query(
+                    query_texts=[user_msg],
+                    n_results=QUERY_N_RESULTS,
+                    where=upload_cache_filter(active_file_hash),
+                    include=['documents', 'distances']
+                )
             # Filter these results as well
             if session_results and session_results['distances']:
                 for i, dist in enumerate(session_results['distances'][0]):